@@ -4,21 +4,27 @@ FastAPI сервер для тестирования с 11 специализа
 """
 from fastapi import FastAPI, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
-from typing import List, Dict, Optional, Set
-from datetime import datetime, timedelta
-import json
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, Field, field_validator
+from typing import List, Dict, Optional, Tuple, Annotated
+from functools import lru_cache
+from dataclasses import dataclass, replace
+from contextlib import contextmanager
+import orjson
 import random
+import secrets
 import sqlite3
+import sys
+import threading
+import time
 from pathlib import Path
-import hashlib
-import hmac
 from urllib.parse import parse_qs
 
 app = FastAPI(
     title="ФССП Test Bot API",
     description="API для Telegram Mini App тестирования сотрудников ФССП",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # CORS для работы с Telegram Mini App
@@ -32,11 +38,18 @@ app.add_middleware(
 
 # === MODELS ===
 
-class Question(BaseModel):
+# Номера вариантов ответа хранятся битовой маской в INTEGER (64 бита со знаком)
+MAX_OPTION_INDEX = 62
+
+AnswerIndex = Annotated[int, Field(ge=0, le=MAX_OPTION_INDEX)]
+
+# Внутреннее представление вопроса: валидация Pydantic здесь не нужна
+@dataclass(slots=True, frozen=True)
+class Question:
     id: int
     question: str
-    options: List[str]
-    correct_answers: Set[int]
+    options: Tuple[str, ...]
+    correct_mask: int
 
 class StartTestRequest(BaseModel):
     telegram_id: int
@@ -45,12 +58,18 @@ class StartTestRequest(BaseModel):
     department: str
     specialization: str
     difficulty: str
+    
+    @field_validator("specialization", "difficulty")
+    @classmethod
+    def intern_key(cls, value: str) -> str:
+        # Интернированная строка совпадает с ключом словаря по указателю
+        return sys.intern(value)
 
 class SubmitAnswerRequest(BaseModel):
     telegram_id: int
     session_id: str
     question_id: int
-    selected_answers: List[int]
+    selected_answers: List[AnswerIndex]
 
 class FinishTestRequest(BaseModel):
     telegram_id: int
@@ -67,9 +86,146 @@ class TestResult(BaseModel):
 
 DB_PATH = Path(__file__).parent / "test_bot.db"
 
-def init_db():
+ANSWERS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS answers (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        session_id TEXT NOT NULL,
+        question_id INTEGER NOT NULL,
+        selected_mask INTEGER NOT NULL,
+        is_correct INTEGER DEFAULT 0,
+        answered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (session_id) REFERENCES test_sessions(session_id)
+    )
+"""
+
+# Запросы эндпоинтов: одни и те же строки попадают в кэш подготовленных выражений
+
+SQL_INSERT_SESSION = """
+    INSERT INTO test_sessions
+    (session_id, telegram_id, full_name, position, department, specialization, difficulty,
+     questions_json, started_at_epoch)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+SQL_SELECT_SESSION_STATUS = """
+    SELECT status FROM test_sessions WHERE session_id = ?
+"""
+
+SQL_SAVE_ANSWER = """
+    INSERT INTO answers (session_id, question_id, selected_mask)
+    VALUES (?, ?, ?)
+    ON CONFLICT(session_id, question_id) DO UPDATE SET
+        selected_mask = excluded.selected_mask,
+        answered_at = CURRENT_TIMESTAMP
+"""
+
+SQL_SELECT_ACTIVE_SESSION = """
+    SELECT specialization, difficulty, started_at_epoch, full_name, position, department,
+           questions_json
+    FROM test_sessions
+    WHERE session_id = ? AND telegram_id = ? AND status = 'active'
+"""
+
+SQL_SELECT_ANSWER_MASKS = """
+    SELECT question_id, selected_mask
+    FROM answers
+    WHERE session_id = ?
+"""
+
+SQL_FINISH_SESSION = """
+    UPDATE test_sessions
+    SET status = 'finished', finished_at = CURRENT_TIMESTAMP
+    WHERE session_id = ?
+"""
+
+SQL_INSERT_RESULT = """
+    INSERT INTO results
+    (session_id, telegram_id, specialization, difficulty, correct_answers,
+     total_questions, percentage, grade, time_spent)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+SQL_UPSERT_USER_STATS = """
+    INSERT INTO user_stats (telegram_id, total_tests)
+    VALUES (?, 1)
+    ON CONFLICT(telegram_id) DO UPDATE SET
+        total_tests = total_tests + 1,
+        last_activity = CURRENT_TIMESTAMP
+"""
+
+SQL_SELECT_USER_STATS = """
+    SELECT
+        COUNT(*) as total_tests,
+        ROUND(COALESCE(AVG(percentage), 0), 1) as avg_percentage,
+        ROUND(COALESCE(MAX(percentage), 0), 1) as best_percentage,
+        (
+            SELECT json_group_array(json_object(
+                'specialization', specialization,
+                'difficulty', difficulty,
+                'grade', grade,
+                'percentage', ROUND(percentage, 1),
+                'date', created_at
+            ))
+            FROM (
+                SELECT specialization, difficulty, grade, percentage, created_at
+                FROM results
+                WHERE telegram_id = ?
+                ORDER BY created_at DESC
+                LIMIT 5
+            )
+        ) as recent_results
+    FROM results
+    WHERE telegram_id = ?
+"""
+
+SQL_SELECT_USER_GRADES = """
+    SELECT grade, COUNT(*)
+    FROM results
+    WHERE telegram_id = ?
+    GROUP BY grade
+"""
+
+SQL_SELECT_SESSION_RESULT = """
+    SELECT status, questions_json
+    FROM test_sessions
+    WHERE session_id = ? AND telegram_id = ?
+"""
+
+# SQLite сериализует запись, поэтому пишущие транзакции выполняются под блокировкой
+db_write_lock = threading.Lock()
+
+def connect_db() -> sqlite3.Connection:
+    """Открытие общего соединения с БД (WAL, autocommit)"""
+    conn = sqlite3.connect(
+        DB_PATH, check_same_thread=False, isolation_level=None, cached_statements=256
+    )
+    conn.executescript("""
+        PRAGMA journal_mode=WAL;
+        PRAGMA synchronous=NORMAL;
+        PRAGMA temp_store=MEMORY;
+        PRAGMA cache_size=-20000;
+        PRAGMA foreign_keys=ON;
+    """)
+    return conn
+
+def get_db() -> sqlite3.Connection:
+    """Зависимость FastAPI: общее соединение с БД"""
+    return app.state.db
+
+@contextmanager
+def write_transaction(conn: sqlite3.Connection):
+    """Пишущая транзакция: BEGIN IMMEDIATE ... COMMIT, ROLLBACK при ошибке"""
+    with db_write_lock:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn.cursor()
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+def init_db(conn: sqlite3.Connection):
     """Инициализация базы данных"""
-    conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
     
     # Таблица тестовых сессий
@@ -84,22 +240,47 @@ def init_db():
             difficulty TEXT NOT NULL,
             started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             finished_at TIMESTAMP,
-            status TEXT DEFAULT 'active'
+            status TEXT DEFAULT 'active',
+            questions_json TEXT,
+            started_at_epoch INTEGER
         )
     """)
     
-    # Таблица ответов
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS answers (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            session_id TEXT NOT NULL,
-            question_id INTEGER NOT NULL,
-            selected_answers TEXT NOT NULL,
-            is_correct INTEGER DEFAULT 0,
-            answered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (session_id) REFERENCES test_sessions(session_id)
+    # Миграция: колонки с выданными вопросами и временем старта для старых баз
+    cursor.execute("PRAGMA table_info(test_sessions)")
+    sessions_columns = {row[1] for row in cursor.fetchall()}
+    if "questions_json" not in sessions_columns:
+        cursor.execute("ALTER TABLE test_sessions ADD COLUMN questions_json TEXT")
+    if "started_at_epoch" not in sessions_columns:
+        cursor.execute("ALTER TABLE test_sessions ADD COLUMN started_at_epoch INTEGER")
+        cursor.execute(
+            "UPDATE test_sessions SET started_at_epoch = CAST(strftime('%s', started_at) AS INTEGER)"
         )
-    """)
+    
+    # Миграция: выбранные ответы из CSV-строки в битовую маску
+    cursor.execute("PRAGMA table_info(answers)")
+    answers_columns = {row[1] for row in cursor.fetchall()}
+    if answers_columns and "selected_mask" not in answers_columns:
+        with write_transaction(conn) as tx:
+            tx.execute("ALTER TABLE answers RENAME TO answers_old")
+            tx.execute(ANSWERS_TABLE_SQL)
+            tx.execute(
+                "SELECT id, session_id, question_id, selected_answers, is_correct, answered_at "
+                "FROM answers_old"
+            )
+            tx.executemany("""
+                INSERT INTO answers
+                (id, session_id, question_id, selected_mask, is_correct, answered_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, [
+                (row_id, sid, qid, answers_to_mask(int(x) for x in ans.split(',') if x),
+                 is_correct, answered_at)
+                for row_id, sid, qid, ans, is_correct, answered_at in tx.fetchall()
+            ])
+            tx.execute("DROP TABLE answers_old")
+    
+    # Таблица ответов
+    cursor.execute(ANSWERS_TABLE_SQL)
     
     # Таблица результатов
     cursor.execute("""
@@ -131,21 +312,49 @@ def init_db():
         )
     """)
     
-    conn.commit()
-    conn.close()
+    # Миграция: в старых базах ответы могли дублироваться, оставляем последний
+    cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_answers_session_question'"
+    )
+    if not cursor.fetchone():
+        cursor.execute("""
+            DELETE FROM answers
+            WHERE id NOT IN (SELECT MAX(id) FROM answers GROUP BY session_id, question_id)
+        """)
+    
+    # Индексы (idx_answers_session_question покрывает и поиск по session_id)
+    cursor.executescript("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_answers_session_question
+            ON answers(session_id, question_id);
+        CREATE INDEX IF NOT EXISTS idx_results_tg_created
+            ON results(telegram_id, created_at DESC);
+        CREATE INDEX IF NOT EXISTS idx_sessions_tg
+            ON test_sessions(telegram_id);
+    """)
 
 # === QUESTION LOADER ===
 
 QUESTIONS_DIR = Path(__file__).parent.parent / "questions"
 
-def load_questions(specialization: str) -> List[Dict]:
-    """Загрузка вопросов из JSON"""
+@lru_cache(maxsize=32)
+def load_questions(specialization: str) -> Tuple[Question, ...]:
+    """Загрузка вопросов из JSON (кэшируется на время работы процесса)"""
     file_path = QUESTIONS_DIR / f"{specialization}.json"
     if not file_path.exists():
-        return []
+        return ()
+    
+    raw = orjson.loads(file_path.read_bytes())
     
-    with open(file_path, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    # Преобразуем в модель Question один раз при загрузке
+    return tuple(
+        Question(
+            id=i,
+            question=q['question'],
+            options=tuple(q['options']),
+            correct_mask=answers_to_mask(int(x) for x in q['correct_answers'].split(','))
+        )
+        for i, q in enumerate(raw)
+    )
 
 def select_questions(specialization: str, difficulty: str, count: int) -> List[Question]:
     """Выбор случайных вопросов по уровню сложности"""
@@ -153,20 +362,18 @@ def select_questions(specialization: str, difficulty: str, count: int) -> List[Q
     if not all_questions:
         return []
     
-    # Перемешиваем и берем нужное количество
-    random.shuffle(all_questions)
-    selected = all_questions[:count]
+    # Частичное перемешивание Фишера–Йетса: ровно count перестановок
+    # по массиву индексов, кэшированный кортеж не изменяется
+    total = len(all_questions)
+    count = min(count, total)
+    idx = list(range(total))
     
-    # Преобразуем в модель Question
     questions = []
-    for i, q in enumerate(selected):
-        correct = set(int(x) for x in q['correct_answers'].split(','))
-        questions.append(Question(
-            id=i,
-            question=q['question'],
-            options=q['options'],
-            correct_answers=correct
-        ))
+    for i in range(count):
+        j = random.randrange(i, total)
+        idx[i], idx[j] = idx[j], idx[i]
+        # Нумеруем выбранные вопросы заново: 0..count-1
+        questions.append(replace(all_questions[idx[i]], id=i))
     
     return questions
 
@@ -193,6 +400,10 @@ SPECIALIZATIONS = {
     "upravlenie": "Управление"
 }
 
+# Ключи интернируются, чтобы поиск по ним сводился к сравнению указателей
+DIFFICULTY_CONFIG = {sys.intern(k): v for k, v in DIFFICULTY_CONFIG.items()}
+SPECIALIZATIONS = {sys.intern(k): v for k, v in SPECIALIZATIONS.items()}
+
 def calculate_grade(percentage: float) -> str:
     """Расчет оценки по проценту правильных ответов"""
     if percentage >= 80:
@@ -204,18 +415,55 @@ def calculate_grade(percentage: float) -> str:
     else:
         return "неудовлетворительно"
 
+def answers_to_mask(answers) -> int:
+    """Упаковка номеров вариантов ответа в битовую маску"""
+    mask = 0
+    for i in answers:
+        mask |= 1 << i
+    return mask
+
+def mask_to_answers(mask: int) -> List[int]:
+    """Распаковка битовой маски в отсортированный список номеров вариантов"""
+    return [i for i in range(mask.bit_length()) if mask >> i & 1]
+
 def generate_session_id(telegram_id: int) -> str:
     """Генерация уникального ID сессии"""
-    timestamp = datetime.now().isoformat()
-    return hashlib.sha256(f"{telegram_id}{timestamp}".encode()).hexdigest()[:16]
+    return secrets.token_hex(8)
+
+def check_active_session(cursor: sqlite3.Cursor, session_id: str):
+    """Проверка, что сессия существует и не завершена"""
+    cursor.execute(SQL_SELECT_SESSION_STATUS, (session_id,))
+    row = cursor.fetchone()
+    
+    if not row:
+        raise HTTPException(status_code=404, detail="Session not found")
+    
+    if row[0] != "active":
+        raise HTTPException(status_code=400, detail="Session is not active")
 
 # === ENDPOINTS ===
+# Эндпоинты, работающие с SQLite, объявлены через def: FastAPI выполняет их
+# в пуле потоков, и блокирующий ввод-вывод не останавливает event loop.
+# Основные эндпоинты возвращают ORJSONResponse напрямую, минуя jsonable_encoder
 
 @app.on_event("startup")
 async def startup_event():
     """Инициализация при запуске"""
-    init_db()
+    app.state.db = connect_db()
+    init_db(app.state.db)
     print("✅ Database initialized")
+    
+    # Прогрев кэша вопросов (пустой результат тоже кэшируется до перезапуска)
+    missing = [spec for spec in SPECIALIZATIONS if not load_questions(spec)]
+    if missing:
+        print(f"⚠️ No questions loaded from {QUESTIONS_DIR} for: {', '.join(missing)}")
+    else:
+        print("✅ Questions loaded")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Закрытие соединения с БД при остановке"""
+    app.state.db.close()
 
 @app.get("/")
 async def root():
@@ -251,7 +499,7 @@ async def get_difficulties():
     }
 
 @app.post("/api/test/start")
-async def start_test(request: StartTestRequest):
+def start_test(request: StartTestRequest, db: sqlite3.Connection = Depends(get_db)):
     """Начало теста - получение вопросов"""
     # Проверка специализации и сложности
     if request.specialization not in SPECIALIZATIONS:
@@ -274,29 +522,33 @@ async def start_test(request: StartTestRequest):
     if not questions:
         raise HTTPException(status_code=500, detail="Failed to load questions")
     
-    # Сохранение сессии в БД
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        INSERT INTO test_sessions 
-        (session_id, telegram_id, full_name, position, department, specialization, difficulty)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    """, (
-        session_id,
-        request.telegram_id,
-        request.full_name,
-        request.position,
-        request.department,
-        request.specialization,
-        request.difficulty
-    ))
+    # Выданные вопросы сохраняются вместе с сессией для последующей проверки
+    questions_json = orjson.dumps([
+        {
+            "id": q.id,
+            "question": q.question,
+            "options": q.options,
+            "correct_mask": q.correct_mask
+        }
+        for q in questions
+    ]).decode()
     
-    conn.commit()
-    conn.close()
+    # Сохранение сессии в БД
+    with write_transaction(db) as cursor:
+        cursor.execute(SQL_INSERT_SESSION, (
+            session_id,
+            request.telegram_id,
+            request.full_name,
+            request.position,
+            request.department,
+            request.specialization,
+            request.difficulty,
+            questions_json,
+            int(time.time())
+        ))
     
     # Возвращаем вопросы БЕЗ правильных ответов
-    return {
+    return ORJSONResponse({
         "session_id": session_id,
         "time_minutes": config["time"],
         "questions": [
@@ -306,137 +558,102 @@ async def start_test(request: StartTestRequest):
                 "options": q.options
             }
             for q in questions
-        ],
-        # Храним правильные ответы отдельно для проверки
-        "_answers": {str(q.id): list(q.correct_answers) for q in questions}
-    }
+        ]
+    })
 
 @app.post("/api/test/answer")
-async def submit_answer(request: SubmitAnswerRequest):
+def submit_answer(request: SubmitAnswerRequest, db: sqlite3.Connection = Depends(get_db)):
     """Сохранение ответа на вопрос (без проверки правильности)"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    # Проверка существования сессии
-    cursor.execute(
-        "SELECT status FROM test_sessions WHERE session_id = ?",
-        (request.session_id,)
-    )
-    row = cursor.fetchone()
-    
-    if not row:
-        conn.close()
-        raise HTTPException(status_code=404, detail="Session not found")
-    
-    if row[0] != "active":
-        conn.close()
-        raise HTTPException(status_code=400, detail="Session is not active")
-    
-    # Сохранение ответа
-    cursor.execute("""
-        INSERT OR REPLACE INTO answers (session_id, question_id, selected_answers)
-        VALUES (?, ?, ?)
-    """, (
-        request.session_id,
-        request.question_id,
-        ','.join(map(str, request.selected_answers))
-    ))
+    with write_transaction(db) as cursor:
+        # Проверка существования сессии
+        check_active_session(cursor, request.session_id)
+        
+        # Сохранение ответа
+        cursor.execute(SQL_SAVE_ANSWER, (
+            request.session_id,
+            request.question_id,
+            answers_to_mask(request.selected_answers)
+        ))
     
-    conn.commit()
-    conn.close()
+    return {"status": "ok"}
+
+@app.post("/api/test/answers/bulk")
+def submit_answers_bulk(requests: List[SubmitAnswerRequest], db: sqlite3.Connection = Depends(get_db)):
+    """Сохранение нескольких ответов одной транзакцией"""
+    with write_transaction(db) as cursor:
+        # Проверка существования сессий
+        for session_id in {r.session_id for r in requests}:
+            check_active_session(cursor, session_id)
+        
+        # Сохранение ответов
+        cursor.executemany(SQL_SAVE_ANSWER, [
+            (r.session_id, r.question_id, answers_to_mask(r.selected_answers))
+            for r in requests
+        ])
     
     return {"status": "ok"}
 
 @app.post("/api/test/finish")
-async def finish_test(request: FinishTestRequest):
+def finish_test(request: FinishTestRequest, db: sqlite3.Connection = Depends(get_db)):
     """Завершение теста и расчет результата"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    # Получение информации о сессии
-    cursor.execute("""
-        SELECT specialization, difficulty, started_at, full_name, position, department
-        FROM test_sessions
-        WHERE session_id = ? AND telegram_id = ? AND status = 'active'
-    """, (request.session_id, request.telegram_id))
-    
-    session = cursor.fetchone()
-    if not session:
-        conn.close()
-        raise HTTPException(status_code=404, detail="Active session not found")
-    
-    specialization, difficulty, started_at, full_name, position, department = session
-    
-    # Загрузка правильных ответов
-    questions = select_questions(specialization, difficulty, DIFFICULTY_CONFIG[difficulty]["questions"])
-    correct_map = {str(q.id): q.correct_answers for q in questions}
-    
-    # Получение ответов пользователя
-    cursor.execute("""
-        SELECT question_id, selected_answers
-        FROM answers
-        WHERE session_id = ?
-    """, (request.session_id,))
-    
-    user_answers = cursor.fetchall()
-    
-    # Подсчет правильных ответов
-    correct_count = 0
-    total_count = len(questions)
-    
-    for question_id, selected_str in user_answers:
-        selected = set(int(x) for x in selected_str.split(',') if x)
-        correct = correct_map.get(str(question_id), set())
+    with write_transaction(db) as cursor:
+        # Получение информации о сессии
+        cursor.execute(SQL_SELECT_ACTIVE_SESSION, (request.session_id, request.telegram_id))
         
-        if selected == correct:
-            correct_count += 1
-    
-    # Расчет процента и оценки
-    percentage = (correct_count / total_count * 100) if total_count > 0 else 0
-    grade = calculate_grade(percentage)
-    
-    # Расчет времени
-    start_time = datetime.fromisoformat(started_at)
-    time_spent = int((datetime.now() - start_time).total_seconds() / 60)
-    
-    # Обновление статуса сессии
-    cursor.execute("""
-        UPDATE test_sessions
-        SET status = 'finished', finished_at = CURRENT_TIMESTAMP
-        WHERE session_id = ?
-    """, (request.session_id,))
-    
-    # Сохранение результата
-    cursor.execute("""
-        INSERT INTO results 
-        (session_id, telegram_id, specialization, difficulty, correct_answers, 
-         total_questions, percentage, grade, time_spent)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (
-        request.session_id,
-        request.telegram_id,
-        specialization,
-        difficulty,
-        correct_count,
-        total_count,
-        percentage,
-        grade,
-        time_spent
-    ))
-    
-    # Обновление статистики пользователя
-    cursor.execute("""
-        INSERT INTO user_stats (telegram_id, total_tests)
-        VALUES (?, 1)
-        ON CONFLICT(telegram_id) DO UPDATE SET
-            total_tests = total_tests + 1,
-            last_activity = CURRENT_TIMESTAMP
-    """, (request.telegram_id,))
-    
-    conn.commit()
-    conn.close()
+        session = cursor.fetchone()
+        if not session:
+            raise HTTPException(status_code=404, detail="Active session not found")
+        
+        (specialization, difficulty, started_at_epoch, full_name, position, department,
+         questions_json) = session
+        
+        # Сессии, начатые до обновления, не хранят выданные вопросы
+        if questions_json is None:
+            raise HTTPException(status_code=409, detail="Session started before upgrade")
+        
+        # Правильные ответы на вопросы, выданные при старте
+        questions = orjson.loads(questions_json)
+        correct_mask_by_qid = {q["id"]: q["correct_mask"] for q in questions}
+        
+        # Получение ответов пользователя
+        cursor.execute(SQL_SELECT_ANSWER_MASKS, (request.session_id,))
+        
+        user_answers = cursor.fetchall()
+        
+        # Подсчет правильных ответов: сравнение масок
+        total_count = len(questions)
+        correct_count = sum(
+            1 for question_id, selected_mask in user_answers
+            if selected_mask == correct_mask_by_qid.get(question_id)
+        )
+        
+        # Расчет процента и оценки
+        percentage = (correct_count / total_count * 100) if total_count > 0 else 0
+        grade = calculate_grade(percentage)
+        
+        # Расчет времени
+        time_spent = (int(time.time()) - started_at_epoch) // 60
+        
+        # Обновление статуса сессии
+        cursor.execute(SQL_FINISH_SESSION, (request.session_id,))
+        
+        # Сохранение результата
+        cursor.execute(SQL_INSERT_RESULT, (
+            request.session_id,
+            request.telegram_id,
+            specialization,
+            difficulty,
+            correct_count,
+            total_count,
+            percentage,
+            grade,
+            time_spent
+        ))
+        
+        # Обновление статистики пользователя
+        cursor.execute(SQL_UPSERT_USER_STATS, (request.telegram_id,))
     
-    return {
+    return ORJSONResponse({
         "result": {
             "correct": correct_count,
             "total": total_count,
@@ -448,125 +665,86 @@ async def finish_test(request: FinishTestRequest):
             "department": department,
             "specialization": SPECIALIZATIONS[specialization]
         }
-    }
+    })
 
 @app.get("/api/stats/{telegram_id}")
-async def get_user_stats(telegram_id: int):
+def get_user_stats(telegram_id: int, db: sqlite3.Connection = Depends(get_db)):
     """Получение статистики пользователя"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    cursor = db.cursor()
     
-    # Общая статистика
-    cursor.execute("""
-        SELECT 
-            COUNT(*) as total_tests,
-            AVG(percentage) as avg_percentage,
-            MAX(percentage) as best_percentage,
-            SUM(CASE WHEN grade = 'отлично' THEN 1 ELSE 0 END) as excellent,
-            SUM(CASE WHEN grade = 'хорошо' THEN 1 ELSE 0 END) as good,
-            SUM(CASE WHEN grade = 'удовлетворительно' THEN 1 ELSE 0 END) as satisfactory,
-            SUM(CASE WHEN grade = 'неудовлетворительно' THEN 1 ELSE 0 END) as fail
-        FROM results
-        WHERE telegram_id = ?
-    """, (telegram_id,))
+    # Общая статистика и последние результаты одним запросом
+    cursor.execute(SQL_SELECT_USER_STATS, (telegram_id, telegram_id))
     
     stats = cursor.fetchone()
     
-    # Последние результаты
-    cursor.execute("""
-        SELECT specialization, difficulty, grade, percentage, created_at
-        FROM results
-        WHERE telegram_id = ?
-        ORDER BY created_at DESC
-        LIMIT 5
-    """, (telegram_id,))
-    
-    recent = cursor.fetchall()
+    recent = orjson.loads(stats[3])
+    for r in recent:
+        r["specialization"] = SPECIALIZATIONS.get(r["specialization"], r["specialization"])
     
-    conn.close()
+    # Количество результатов по оценкам
+    cursor.execute(SQL_SELECT_USER_GRADES, (telegram_id,))
+    by_grade = dict(cursor.fetchall())
     
-    return {
-        "total_tests": stats[0] or 0,
-        "avg_percentage": round(stats[1] or 0, 1),
-        "best_percentage": round(stats[2] or 0, 1),
+    return ORJSONResponse({
+        "total_tests": stats[0],
+        "avg_percentage": stats[1],
+        "best_percentage": stats[2],
         "grades": {
-            "excellent": stats[3] or 0,
-            "good": stats[4] or 0,
-            "satisfactory": stats[5] or 0,
-            "fail": stats[6] or 0
+            "excellent": by_grade.get("отлично", 0),
+            "good": by_grade.get("хорошо", 0),
+            "satisfactory": by_grade.get("удовлетворительно", 0),
+            "fail": by_grade.get("неудовлетворительно", 0)
         },
-        "recent_results": [
-            {
-                "specialization": SPECIALIZATIONS.get(r[0], r[0]),
-                "difficulty": r[1],
-                "grade": r[2],
-                "percentage": round(r[3], 1),
-                "date": r[4]
-            }
-            for r in recent
-        ]
-    }
+        "recent_results": recent
+    })
 
 @app.get("/api/result/{session_id}")
-async def get_test_result(session_id: str, telegram_id: int):
+def get_test_result(session_id: str, telegram_id: int, db: sqlite3.Connection = Depends(get_db)):
     """Получение детального результата теста с правильными ответами"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    cursor = db.cursor()
     
     # Проверка доступа
-    cursor.execute("""
-        SELECT specialization, difficulty, status
-        FROM test_sessions
-        WHERE session_id = ? AND telegram_id = ?
-    """, (session_id, telegram_id))
+    cursor.execute(SQL_SELECT_SESSION_RESULT, (session_id, telegram_id))
     
     session = cursor.fetchone()
     if not session:
-        conn.close()
         raise HTTPException(status_code=404, detail="Session not found")
     
-    specialization, difficulty, status = session
+    status, questions_json = session
     
     if status != "finished":
-        conn.close()
         raise HTTPException(status_code=400, detail="Test not finished yet")
     
-    # Загрузка вопросов с правильными ответами
-    questions = select_questions(specialization, difficulty, DIFFICULTY_CONFIG[difficulty]["questions"])
+    # Сессии, начатые до обновления, не хранят выданные вопросы
+    if questions_json is None:
+        raise HTTPException(status_code=409, detail="Session started before upgrade")
+    
+    # Вопросы с правильными ответами, выданные при старте
+    questions = orjson.loads(questions_json)
     
     # Получение ответов пользователя
-    cursor.execute("""
-        SELECT question_id, selected_answers
-        FROM answers
-        WHERE session_id = ?
-    """, (session_id,))
-    
-    user_answers_raw = cursor.fetchall()
-    user_answers = {
-        int(qid): set(int(x) for x in ans.split(',') if x)
-        for qid, ans in user_answers_raw
-    }
+    cursor.execute(SQL_SELECT_ANSWER_MASKS, (session_id,))
     
-    conn.close()
+    user_masks = dict(cursor.fetchall())
     
-    # Формирование детального результата
+    # Формирование детального результата: сравнение масок,
+    # списки номеров вариантов нужны только для ответа клиенту
     detailed_results = []
     for q in questions:
-        user_ans = user_answers.get(q.id, set())
-        is_correct = user_ans == q.correct_answers
+        user_mask = user_masks.get(q["id"], 0)
         
         detailed_results.append({
-            "question_id": q.id,
-            "question": q.question,
-            "options": q.options,
-            "user_answers": sorted(list(user_ans)),
-            "correct_answers": sorted(list(q.correct_answers)),
-            "is_correct": is_correct
+            "question_id": q["id"],
+            "question": q["question"],
+            "options": q["options"],
+            "user_answers": mask_to_answers(user_mask),
+            "correct_answers": mask_to_answers(q["correct_mask"]),
+            "is_correct": user_mask == q["correct_mask"]
         })
     
-    return {
+    return ORJSONResponse({
         "questions": detailed_results
-    }
+    })
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,19 @@
+"""
+Сборка main.py в C-расширение через Cython (необязательно).
+
+    pip install "cython>=3,<4"
+    python setup.py build_ext --inplace
+
+Собранный main.*.so импортируется вместо main.py без изменений в коде.
+"""
+from setuptools import setup
+from Cython.Build import cythonize
+
+setup(
+    name="fssp-test-backend",
+    ext_modules=cythonize(
+        ["main.py"],
+        language_level=3,
+        compiler_directives={"boundscheck": False, "wraparound": False}
+    )
+)